@@ -1,16 +1,11 @@
-import xlrd
-loc1 = ("D:\\Important Data\\weekly_task.xlsx")
-
-wb1 = xlrd.open_workbook(loc)
-sheet1 = wb1.sheet_by_index(0)
-
-loc2 = ("D:\\Important Data\\weekly_task.xlsx")
+import os
+import sys
 
-wb2 = xlrd.open_workbook(loc)
-sheet2 = wb2.sheet_by_index(0)
-
-noOfRows1=sheet1.nrows
-noOfRows2=sheet2.nrows
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utility_functions"))
+from xlsx_comparison import xlsx_comparison
 
+loc1 = ("D:\\Important Data\\weekly_task.xlsx")
 
+loc2 = ("D:\\Important Data\\weekly_task_new.xlsx")
 
+xlsx_comparison(loc1, loc2, "D:\\Important Data\\weekly_task_difference.csv")
@@ -0,0 +1,218 @@
+'''
+    In-process HTTP prober for server_check.
+
+    Replaces one wget child process per URL by http.client connections that
+    are kept alive and pooled per host. Host names are resolved once per
+    dns_ttl seconds, TLS sessions are resumed on new connections to the same
+    host, and redirects are followed by hand so that every Location target
+    is recorded. Certificates are not verified, as with wget
+    --no-check-certificate, unless verify is True.
+
+    Every probe is timed by phase, in seconds: dns, connect, tls, ttfb (from
+    sending the request to the response headers) and total. Phases of
+    redirects are added up. Only the phases that happened are recorded: a
+    probe on pooled connections has no dns, connect or tls timing, a new
+    connection to a host resolved less than dns_ttl seconds ago no dns
+    timing and a plain HTTP connection no tls timing.
+
+    USAGE:
+        prober = HttpProber(timeout=60)
+        result = prober.probe("https://vdevpril207am.ux.dsone.3ds.com:453/iam/")
+        result.status, result.redirects, result.error, result.timings
+        prober.close()
+'''
+
+import ssl
+import time
+import socket
+import threading
+import http.client
+from urllib.parse import urljoin, urlsplit
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PHASES = ["dns", "connect", "tls", "ttfb", "total"]
+
+
+class ProbeResult:
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.reason = ""
+        self.body = b""
+        # (status code, Location target) of every redirect followed
+        self.redirects = []
+        self.error = None
+        # phase -> seconds, for the phases that happened
+        self.timings = {}
+
+
+class ProbeConnection(http.client.HTTPConnection):
+    """HTTP or HTTPS connection that resolves its host through the DNS
+    cache of the prober and resumes the last TLS session of the host."""
+
+    def __init__(self, prober, scheme, host, port, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self.prober = prober
+        self.scheme = scheme
+        self.timings = {}
+
+    def connect(self):
+        self.timings = {}
+        start = time.perf_counter()
+        address = self.prober.cached_address(self.host, self.port)
+        if address is None:
+            address = self.prober.resolve(self.host, self.port)
+            self.timings["dns"] = time.perf_counter() - start
+        resolved = time.perf_counter()
+        self.sock = socket.create_connection(address, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connected = time.perf_counter()
+        if self.scheme == "https":
+            self.sock = self.prober.context.wrap_socket(
+                self.sock,
+                server_hostname=self.host,
+                session=self.prober.tls_session(self.host, self.port),
+            )
+            self.prober.save_tls_session(self.host, self.port, self.sock)
+        self.timings["connect"] = connected - resolved
+        if self.scheme == "https":
+            self.timings["tls"] = time.perf_counter() - connected
+
+
+class HttpProber:
+    def __init__(
+        self, timeout=60, max_idle=4, dns_ttl=300, max_redirects=5, verify=False
+    ):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.dns_ttl = dns_ttl
+        self.max_redirects = max_redirects
+        self.context = ssl.create_default_context()
+        if not verify:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.lock = threading.Lock()
+        self.addresses = {}
+        self.tls_sessions = {}
+        self.idle_connections = {}
+
+    def cached_address(self, host, port):
+        """(address, port) of host if resolved less than dns_ttl seconds ago."""
+        with self.lock:
+            cached = self.addresses.get((host, port))
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def resolve(self, host, port):
+        """(address, port) of host, cached for dns_ttl seconds."""
+        cached = self.cached_address(host, port)
+        if cached:
+            return cached
+        info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = info[0][4][:2]
+        with self.lock:
+            self.addresses[(host, port)] = (address, time.monotonic() + self.dns_ttl)
+        return address
+
+    def tls_session(self, host, port):
+        with self.lock:
+            return self.tls_sessions.get((host, port))
+
+    def save_tls_session(self, host, port, sock):
+        if sock.session is not None:
+            with self.lock:
+                self.tls_sessions[(host, port)] = sock.session
+
+    def get_connection(self, key):
+        """Return (connection, reused) for key (scheme, host, port)."""
+        with self.lock:
+            idle = self.idle_connections.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        return ProbeConnection(self, scheme, host, port, self.timeout), False
+
+    def release_connection(self, key, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        if connection.scheme == "https":
+            # TLS 1.3 session tickets only arrive after the handshake.
+            self.save_tls_session(connection.host, connection.port, connection.sock)
+        with self.lock:
+            idle = self.idle_connections.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url):
+        """Send one request on a pooled connection.
+        Returns:
+                (http.client.HTTPResponse, body, timings of the phases)."""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        while True:
+            connection, reused = self.get_connection(key)
+            timings = {}
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    timings.update(connection.timings)
+                sent = time.perf_counter()
+                connection.request(method, path, headers={"User-Agent": "server_check"})
+                response = connection.getresponse()
+                timings["ttfb"] = time.perf_counter() - sent
+                body = response.read()
+            except (
+                http.client.RemoteDisconnected,
+                ConnectionResetError,
+                BrokenPipeError,
+            ):
+                connection.close()
+                # The server closed an idle keep-alive connection: retry on
+                # the next one.
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            self.release_connection(key, connection, response)
+            return response, body, timings
+
+    def probe(self, url, method="HEAD"):
+        """Request url and follow its redirects.
+        Returns:
+                ProbeResult of the last response, error is set when no
+                response could be read."""
+        result = ProbeResult(url)
+        start = time.perf_counter()
+        for hop in range(self.max_redirects + 1):
+            try:
+                response, body, timings = self.request(method, url)
+            except (OSError, http.client.HTTPException) as e:
+                result.error = str(e) or e.__class__.__name__
+                break
+            for phase, seconds in timings.items():
+                result.timings[phase] = result.timings.get(phase, 0.0) + seconds
+            result.status = response.status
+            result.reason = response.reason
+            result.body = body
+            location = response.getheader("Location")
+            if response.status not in REDIRECT_CODES or not location:
+                break
+            url = urljoin(url, location)
+            result.redirects.append((response.status, url))
+        result.timings["total"] = time.perf_counter() - start
+        return result
+
+    def close(self):
+        with self.lock:
+            connections = [c for idle in self.idle_connections.values() for c in idle]
+            self.idle_connections = {}
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,134 @@
+'''
+    Rolling probe latency metrics of server_check.
+
+    The last window timings of every release, service and phase are kept in
+    a JSON summary file next to the daily log, which also lists their
+    percentiles, so that the window rolls over the runs of a day. The
+    percentiles and sample counts of the windows are exported as Prometheus
+    gauges in a text file that a node_exporter textfile collector can read:
+
+        server_check_probe_seconds{release="R423",service="space_url",phase="ttfb",percentile="95"} 0.412
+        server_check_probe_samples{release="R423",service="space_url",phase="ttfb"} 500
+
+    Thresholds on percentiles raise latency alerts, e.g. ("ttfb", 95, 2.0):
+    95th percentile of time to first byte above 2 seconds.
+'''
+
+import os
+import json
+import time
+
+from http_prober import PHASES
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    rank = max(1, -(-percent * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+def parse_thresholds(text):
+    """Parse "ttfb:p95:2,total:p99:10" into [(phase, percentile, seconds)]."""
+    thresholds = []
+    for threshold in text.split(","):
+        phase, percent, seconds = threshold.split(":")
+        if phase not in PHASES:
+            raise ValueError("Unknown phase {}. Use one of {}.".format(phase, PHASES))
+        thresholds.append((phase, int(percent.lstrip("p")), float(seconds)))
+    return thresholds
+
+
+class ProbeMetrics:
+    def __init__(self, summary_path, window=500):
+        self.summary_path = summary_path
+        self.window = window
+        # release -> service -> phase -> last window timings
+        self.samples = {}
+        if os.path.exists(summary_path):
+            with open(summary_path) as summary_file:
+                self.samples = json.load(summary_file).get("samples", {})
+
+    def record(self, release, service, timings):
+        phases = self.samples.setdefault(release, {}).setdefault(service, {})
+        for phase, seconds in timings.items():
+            series = phases.setdefault(phase, [])
+            series.append(round(seconds, 6))
+            del series[: -self.window]
+
+    def series(self):
+        for release in sorted(self.samples):
+            for service in sorted(self.samples[release]):
+                for phase in PHASES:
+                    samples = self.samples[release][service].get(phase)
+                    if samples:
+                        yield release, service, phase, samples
+
+    def percentiles(self):
+        summary = {}
+        for release, service, phase, samples in self.series():
+            phases = summary.setdefault(release, {}).setdefault(service, {})
+            phases[phase] = {"count": len(samples), "max": max(samples)}
+            for percent in PERCENTILES:
+                phases[phase]["p{}".format(percent)] = percentile(samples, percent)
+        return summary
+
+    def write_summary(self):
+        summary = {
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "window": self.window,
+            "percentiles": self.percentiles(),
+            "samples": self.samples,
+        }
+        temp_path = self.summary_path + ".tmp"
+        with open(temp_path, "w") as summary_file:
+            json.dump(summary, summary_file, indent=1)
+        os.replace(temp_path, self.summary_path)
+
+    def write_prometheus(self, prometheus_path):
+        """Write the window percentiles as gauges: the window drops old
+        samples, so its counts are not the cumulative counters of a
+        Prometheus histogram."""
+        seconds_lines = [
+            "# HELP server_check_probe_seconds Probe latency percentile by phase"
+            " over the last {} probes.".format(self.window),
+            "# TYPE server_check_probe_seconds gauge",
+        ]
+        samples_lines = [
+            "# HELP server_check_probe_samples Number of probes in the window.",
+            "# TYPE server_check_probe_samples gauge",
+        ]
+        for release, service, phase, samples in self.series():
+            labels = 'release="{}",service="{}",phase="{}"'.format(
+                release, service, phase
+            )
+            for percent in PERCENTILES:
+                seconds_lines.append(
+                    'server_check_probe_seconds{{{},percentile="{}"}} {}'.format(
+                        labels, percent, percentile(samples, percent)
+                    )
+                )
+            samples_lines.append(
+                "server_check_probe_samples{{{}}} {}".format(labels, len(samples))
+            )
+        lines = seconds_lines + samples_lines
+        temp_path = prometheus_path + ".tmp"
+        with open(temp_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, prometheus_path)
+
+    def latency_alerts(self, thresholds):
+        """(release, service, phase, percentile, seconds, threshold) of every
+        percentile above its threshold."""
+        alerts = []
+        for release, service, phase, samples in self.series():
+            for threshold_phase, percent, threshold in thresholds:
+                if phase == threshold_phase:
+                    seconds = percentile(samples, percent)
+                    if seconds > threshold:
+                        alerts.append(
+                            (release, service, phase, percent, seconds, threshold)
+                        )
+        return alerts
@@ -27,13 +27,34 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import datetime
 import time
+import sqlite3
 import textwrap
+import heapq
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import xml.etree.ElementTree as ET
 import urllib.request as ur
 
+from http_prober import HttpProber
+from probe_metrics import ProbeMetrics, parse_thresholds
+from status_history import StatusHistory, format_time
+
 
 class ServerCheck:
-    def __init__(self, release_level, notify_users):
+    def __init__(
+        self,
+        release_level,
+        notify_users,
+        workers=1,
+        probe_timeout=60,
+        run_deadline=1500,
+        backend="http",
+        latency_thresholds=None,
+        history_path=None,
+        digest_hours=None,
+    ):
         self.now = datetime.datetime.now()
         self.user = os.environ.get("USER")
         if self.user is None:
@@ -57,9 +78,31 @@ class ServerCheck:
             "QC",
             "server_check_log",
         )
-        self.path_wget_exe = os.path.join(self.local, "simqatools", "bin", "wget.exe")
+        self.path_wget_exe = os.path.join(
+            self.local or "", "simqatools", "bin", "wget.exe"
+        )
         self.notify_users = notify_users
         self.release_level = release_level
+        self.workers = workers
+        self.probe_timeout = probe_timeout
+        self.run_deadline = run_deadline
+        self.backend = backend
+        self.prober = HttpProber(timeout=probe_timeout)
+        self.latency_thresholds = latency_thresholds or []
+        # (release, service type) -> timings of the probe phases
+        self.probe_timings = {}
+        # (release, service type) -> url, status, redirect and cos_state of
+        # the last probe
+        self.probe_records = {}
+        # Log lines of the probe running in the current thread, written in
+        # release and service order by check()
+        self.probe_log = threading.local()
+        self.probe_lines = {}
+        self.history_path = history_path or os.path.join(
+            self.local or os.path.expanduser("~"), "server_check", "server_check.db"
+        )
+        self.history = None
+        self.digest_hours = digest_hours
         self.server_release_dict = {
             "R418": "453",
             "R419": "466",
@@ -104,9 +147,10 @@ class ServerCheck:
             level=logging.DEBUG,
             format="%(asctime)s %(levelname)s --> %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
+            force=True,
         )
 
-    def send_email(self, to_address, subject, text=""):
+    def send_email(self, to_address, subject, text="", server=None):
         from_address = "{}@3ds.com".format(self.user)
         format_address = to_address.split(",")
         send_to = ",".join(format_address)
@@ -119,10 +163,21 @@ class ServerCheck:
         body = text
         msg.attach(MIMEText(body, "plain"))
 
-        server = smtplib.SMTP("gimli.ux.dsone.3ds.com")
+        if server is None:
+            server = smtplib.SMTP("gimli.ux.dsone.3ds.com")
         email_text = msg.as_string()
         server.sendmail(from_address, format_address, email_text)
 
+    def log(self, message, level=logging.INFO):
+        """Print and log message, or keep it with the lines of the probe
+        running in the current thread."""
+        lines = getattr(self.probe_log, "lines", None)
+        if lines is None:
+            print(message)
+            logging.log(level, message)
+        else:
+            lines.append((level, message))
+
     def url(self, release, url_type):
         complete_url = (
             "https://vdevpril"
@@ -139,8 +194,7 @@ class ServerCheck:
             + self.server_release_dict.get(release)
             + "am"
         )
-        print("HTTP URL to check cos station: {}".format(http_url))
-        logging.info("HTTP URL to check cos station: {}".format(http_url))
+        self.log("HTTP URL to check cos station: {}".format(http_url))
         return http_url
 
     def get_attributes(self, xml):
@@ -153,18 +207,23 @@ class ServerCheck:
 
     def status_of_cos_service(self, release, url_type):
         url_cos_station = self.url_to_check_cos_station(release, url_type)
-        url = None
-        try:
-            url = ur.urlopen(url_cos_station)
-        except:
-            print(
-                "Not able to fetch COS station status. Reason could be server status(503: Not Available)"
-            )
-            logging.error(
-                "Not able to fetch COS station status. Reason could be server status(503: Not Available)"
+        data = None
+        if self.backend == "http":
+            result = self.prober.probe(url_cos_station, method="GET")
+            if result.error is None and result.status < 400:
+                data = result.body.split(b"\n", 1)[0]
+        else:
+            try:
+                url = ur.urlopen(url_cos_station, timeout=self.probe_timeout)
+                data = url.readline()
+            except:
+                pass
+        if data is None:
+            self.log(
+                "Not able to fetch COS station status. Reason could be server status(503: Not Available)",
+                logging.ERROR,
             )
-        if url:
-            data = url.readline()
+        else:
             xml_str = data.decode("ascii").strip()
             xml = ET.fromstring(xml_str)
             attributes = self.get_attributes(xml)
@@ -173,10 +232,13 @@ class ServerCheck:
                     att_list.get("name")
                     == "vdevpril" + self.server_release_dict.get(release) + "am"
                 ):
+                    self.probe_records[(release, url_type)]["cos_state"] = att_list.get(
+                        "status"
+                    )
                     if att_list.get("status") == "Shutdown":
-                        print("COS Station is {}".format(att_list.get("status")))
-                        logging.error(
-                            "COS Station is {}".format(att_list.get("status"))
+                        self.log(
+                            "COS Station is {}".format(att_list.get("status")),
+                            logging.ERROR,
                         )
                         return """
                     Release: {},
@@ -187,8 +249,7 @@ class ServerCheck:
                             release, url_type, url_cos_station, att_list.get("status")
                         )
                     else:
-                        print("COS Station is {}".format(att_list.get("status")))
-                        logging.info("COS Station is {}".format(att_list.get("status")))
+                        self.log("COS Station is {}".format(att_list.get("status")))
 
     def command_to_run(self, url):
         command = [
@@ -200,7 +261,69 @@ class ServerCheck:
         command.insert(1, url)
         return command
 
+    def kill_probe(self, process, timed_out):
+        timed_out.set()
+        process.kill()
+
+    def failure_info(self, release, url, url_type, reason):
+        self.log("{} for {}: {}.".format(reason, url_type, url), logging.ERROR)
+        return """
+                Release: {},
+                Service Type: {},
+                URL: {}
+                Status code: {},\n\t  Status Message: KO\n\n""".format(
+            release, url_type, url, reason
+        )
+
     def server_response(self, release, url, url_type):
+        if self.backend == "http":
+            return self.http_server_response(release, url, url_type)
+        return self.wget_server_response(release, url, url_type)
+
+    def http_server_response(self, release, url, url_type):
+        url_type_info = """
+                Release: {},
+                Service Type: {},
+                URL: {}
+                """.format(
+            release, url_type, url
+        )
+        result = self.prober.probe(url)
+        record = self.probe_records[(release, url_type)]
+        if result.error is None:
+            self.probe_timings[(release, url_type)] = result.timings
+            record["status"] = str(result.status)
+        else:
+            record["status"] = result.error
+        if result.redirects:
+            record["redirect"] = result.redirects[-1][1]
+        for status, location in result.redirects:
+            self.log("Getting {} status code for {}: {}.".format(status, url_type, url))
+            self.log("So, Redirected URL is: {}".format(location))
+            url = location
+            url_type_info = (
+                url_type_info
+                + """Status code: {},\n\t New URL: {}\n\t""".format(status, url)
+            )
+        if result.error is not None:
+            return self.failure_info(
+                release, url, url_type, "Probe error: {}".format(result.error)
+            )
+        status = str(result.status)
+        if result.status >= 400:
+            status_message = "KO"
+            self.log("Status: {}".format(status), logging.ERROR)
+            self.log("Status Message: {}".format(status_message), logging.ERROR)
+            self.log("Server response is bad.", logging.ERROR)
+            return (
+                url_type_info
+                + "Status code: {},\n\t  Status Message: {}\n\n".format(
+                    status, status_message
+                )
+            )
+        self.log("Status: {}".format(status))
+
+    def wget_server_response(self, release, url, url_type):
         url_type_info = """
                 Release: {},
                 Service Type: {},
@@ -213,6 +336,22 @@ class ServerCheck:
         data = subprocess.Popen(
             command_to_run, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
         )
+        timed_out = threading.Event()
+        timer = threading.Timer(
+            self.probe_timeout, self.kill_probe, args=(data, timed_out)
+        )
+        timer.start()
+        try:
+            url_type_info = self.read_server_response(
+                data, url, url_type, url_type_info
+            )
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            return self.failure_info(release, url, url_type, "Probe timeout")
+        return url_type_info
+
+    def read_server_response(self, data, url, url_type, url_type_info):
         while data.poll() is None:
             data_out = data.stdout.readline()
 
@@ -226,27 +365,19 @@ class ServerCheck:
                             flag = True
                             while flag:
                                 data_out = data.stdout.readline()
+                                if not data_out:
+                                    break
                                 final_data = data_out.decode("ascii").strip()
                                 location_present = re.search(
                                     r"^Location[:]", final_data
                                 )
                                 if location_present:
-                                    logging.info(
-                                        "Getting {} status code for {}: {}.".format(
-                                            status, url_type, url
-                                        )
-                                    )
-                                    print(
+                                    self.log(
                                         "Getting {} status code for {}: {}.".format(
                                             status, url_type, url
                                         )
                                     )
-                                    logging.info(
-                                        "So, Redirected URL is: {}".format(
-                                            final_data[10:]
-                                        )
-                                    )
-                                    print(
+                                    self.log(
                                         "So, Redirected URL is: {}".format(
                                             final_data[10:]
                                         )
@@ -262,12 +393,11 @@ class ServerCheck:
                                     break
                         elif status in self.failure_code:
                             status_message = "KO"
-                            logging.error("Status: {}".format(status))
-                            logging.error("Status Message: {}".format(status_message))
-                            print("Status: {}".format(status))
-                            print("Status Message: {}".format(status_message))
-                            logging.error("Server response is bad.")
-                            print("Server response is bad.")
+                            self.log("Status: {}".format(status), logging.ERROR)
+                            self.log(
+                                "Status Message: {}".format(status_message), logging.ERROR
+                            )
+                            self.log("Server response is bad.", logging.ERROR)
                             url_type_info = (
                                 url_type_info
                                 + "Status code: {},\n\t  Status Message: {}\n\n".format(
@@ -277,41 +407,63 @@ class ServerCheck:
                             return url_type_info
 
                         elif status in self.success_code:
-                            logging.info("Status: {}".format(status))
-                            print("Status: {}".format(status))
+                            self.log("Status: {}".format(status))
 
-    def send_email_according_time(self, all_server_complete_info):
-        if self.notify_users:
+    def send_email_according_time(self, messages):
+        """Send messages, (subject, text) pairs, over one SMTP connection.
+        Users of the time of day are chosen again on every run of the daemon."""
+        notify_users = self.notify_users
+        if notify_users:
             pass
         else:
             tme = ".".join(str(i) for i in [self.now.hour, self.now.minute])
             tme = float(tme)
             if 0 <= tme and tme <= 8:
-                self.notify_users = "abc@xyz.com,def@xyz.com"
+                notify_users = "abc@xyz.com,def@xyz.com"
             if 8 <= tme and tme <= 18:
-                self.notify_users = (
+                notify_users = (
                     "ghi@xyz.com,mno@xyz.com"
                 )
             if 18 <= tme and tme <= 24:
-                self.notify_users = "stu@xyz.com,pqr@xyz.com"
-        self.send_email(
-            to_address=self.notify_users,
-            subject="Server check",
-            text=self.mail_msg(all_server_complete_info),
-        )
-        print("Email sent to: {}".format(self.notify_users))
-        logging.info("Email sent to: {}".format(self.notify_users))
+                notify_users = "stu@xyz.com,pqr@xyz.com"
+        server = smtplib.SMTP("gimli.ux.dsone.3ds.com")
+        try:
+            for subject, text in messages:
+                self.send_email(
+                    to_address=notify_users, subject=subject, text=text, server=server
+                )
+                print("Email sent to: {}".format(notify_users))
+                logging.info("Email sent to: {}".format(notify_users))
+        finally:
+            server.quit()
 
-    def mail_msg(self, all_server_complete_info):
+    def mail_msg(self, all_server_complete_info, recovered_info="", still_down_info=""):
+        sections = ""
         if all_server_complete_info:
+            sections = sections + """
+            Following servers have bad response:
+            {}""".format(
+                all_server_complete_info
+            )
+        if recovered_info:
+            sections = sections + """
+            Following servers have recovered:
+            {}""".format(
+                recovered_info
+            )
+        if still_down_info:
+            sections = sections + """
+            Following servers are still down:
+            {}""".format(
+                still_down_info
+            )
+        if sections:
             msg = """
             Hello,
-
-            Following servers have bad response:
             {}
             Thanks.
             """.format(
-                all_server_complete_info
+                sections
             )
             return msg
 
@@ -325,7 +477,102 @@ class ServerCheck:
         print("Please check log file on link: {}".format(link))
         logging.info("MACHINE: {}".format(self.host_name))
 
-    def run(self):
+    def probe(self, release, url_type):
+        """Check one service of one release.
+        Returns:
+                mail text of the bad responses, empty if the service is good."""
+        url_type_cos_info = None
+        url = self.url(release, url_type)
+        self.log("URL: {}".format(url))
+        self.log("Service Type: {}".format(url_type))
+        self.probe_timings.pop((release, url_type), None)
+        self.probe_records[(release, url_type)] = {
+            "url": url,
+            "status": None,
+            "redirect": None,
+            "cos_state": None,
+        }
+        start = time.perf_counter()
+        url_type_info = self.server_response(release, url, url_type)
+        if self.backend == "wget":
+            self.probe_timings[(release, url_type)] = {
+                "total": time.perf_counter() - start
+            }
+        if url_type == "cos_url":
+            url_type_cos_info = self.status_of_cos_service(release, url_type)
+        server_info = ""
+        if url_type_cos_info:
+            server_info = server_info + url_type_cos_info
+        if url_type_info:
+            server_info = server_info + url_type_info
+        else:
+            self.log("Server response is good.")
+        return server_info
+
+    def logged_probe(self, release, url_type):
+        """probe() keeping its log lines for check()."""
+        self.probe_log.lines = self.probe_lines[(release, url_type)] = []
+        try:
+            return self.probe(release, url_type)
+        finally:
+            self.probe_log.lines = None
+
+    def latency_info(self, probes):
+        """Record the probe timings in the latency metrics next to the log.
+        Returns:
+                dict of (release, service type): mail text of the latency
+                percentiles above their threshold, or None if the metrics
+                could not be written."""
+        try:
+            metrics = ProbeMetrics(
+                os.path.join(self.log_path, self.time_stamp() + "_latency.json")
+            )
+            for release, url_type in probes:
+                timings = self.probe_timings.get((release, url_type))
+                if timings:
+                    metrics.record(release, url_type, timings)
+            metrics.write_summary()
+            metrics.write_prometheus(
+                os.path.join(self.log_path, "server_check_latency.prom")
+            )
+        except (OSError, ValueError) as e:
+            print("Not able to write latency metrics: {}".format(e))
+            logging.error("Not able to write latency metrics: {}".format(e))
+            return None
+        latency_infos = {}
+        for alert in metrics.latency_alerts(self.latency_thresholds):
+            release, url_type, phase, percent, seconds, threshold = alert
+            if (release, url_type) not in probes:
+                continue
+            message = (
+                "Latency of {} for {}: p{} of {} is {:.3f} s, "
+                "threshold {} s.".format(
+                    release, url_type, percent, phase, seconds, threshold
+                )
+            )
+            print(message)
+            logging.error(message)
+            latency_infos[(release, url_type)] = (
+                latency_infos.get((release, url_type), "")
+                + """
+                Release: {},
+                Service Type: {},
+                URL: {}
+                Latency: p{} of {} is {:.3f} s,\n\t  Threshold: {} s\n\n""".format(
+                    release,
+                    url_type,
+                    self.url(release, url_type),
+                    percent,
+                    phase,
+                    seconds,
+                    threshold,
+                )
+            )
+        return latency_infos
+
+    def release_probes(self):
+        """(release, service type) of every service of the releases to check,
+        in release and service order."""
         url_types = [
             "passport_url",
             "space_url",
@@ -333,40 +580,13 @@ class ServerCheck:
             "federated_url",
             "cos_url",
         ]
-        all_server_complete_info = ""
         if self.release_level:
             self.release_level = self.release_level.split(",")
+            probes = []
             for release in self.release_level:
                 if release in self.server_release_dict.keys():
-                    release_header = (
-                        "****************************"
-                        + str(release)
-                        + "****************************"
-                    )
-                    print(release_header)
-                    logging.info(release_header)
                     for url_type in url_types:
-                        url_type_cos_info = None
-                        url = self.url(release, url_type)
-                        print("URL: {}".format(url))
-                        logging.info("URL: {}".format(url))
-                        print("Service Type: {}".format(url_type))
-                        logging.info("Service Type: {}".format(url_type))
-                        url_type_info = self.server_response(release, url, url_type)
-                        if url_type == "cos_url":
-                            url_type_cos_info = self.status_of_cos_service(
-                                release, url_type
-                            )
-                        if url_type_cos_info:
-                            all_server_complete_info = (
-                                all_server_complete_info + url_type_cos_info
-                            )
-                        if url_type_info:
-                            all_server_complete_info = (
-                                all_server_complete_info + url_type_info
-                            )
-                        else:
-                            logging.info("Server response is good.")
+                        probes.append((release, url_type))
                 else:
                     logging.error(
                         "Please mention Release level from: {}.".format(
@@ -377,9 +597,265 @@ class ServerCheck:
         else:
             logging.error("Please mention Release level in the format 'R4XX'.")
             sys.exit(1)
+        return probes
 
-        if all_server_complete_info:
-            self.send_email_according_time(all_server_complete_info)
+    def check(self, probes):
+        """Probe concurrently. The log lines of every probe are written once
+        all are done, under the header of their release and in the order of
+        probes, so that concurrent probes do not interleave.
+        Returns:
+                mail text of every probe, in the order of probes."""
+        self.probe_lines = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [
+            executor.submit(self.logged_probe, release, url_type)
+            for release, url_type in probes
+        ]
+        wait(futures, timeout=self.run_deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+        probe_infos = []
+        header_release = None
+        for (release, url_type), future in zip(probes, futures):
+            if release != header_release:
+                self.log(
+                    "****************************"
+                    + str(release)
+                    + "****************************"
+                )
+                header_release = release
+            for level, message in self.probe_lines.pop((release, url_type), []):
+                self.log(message, level)
+            if future.done() and not future.cancelled():
+                probe_infos.append(future.result())
+            else:
+                probe_infos.append(
+                    self.failure_info(
+                        release, self.url(release, url_type), url_type, "Run deadline"
+                    )
+                )
+        return probe_infos
+
+    def record_history(self, probes, probe_infos):
+        """Insert the results of a run in the status history database."""
+        probe_time = time.time()
+        rows = []
+        for (release, url_type), probe_info in zip(probes, probe_infos):
+            record = self.probe_records.get((release, url_type), {})
+            timings = self.probe_timings.get((release, url_type), {})
+            rows.append(
+                (
+                    probe_time,
+                    release,
+                    url_type,
+                    record.get("url", self.url(release, url_type)),
+                    record.get("status"),
+                    0 if probe_info else 1,
+                    timings.get("total"),
+                    record.get("redirect"),
+                    record.get("cos_state"),
+                )
+            )
+        try:
+            self.open_history().add_probes(rows)
+        except (OSError, sqlite3.Error) as e:
+            print("Not able to write status history: {}".format(e))
+            logging.error("Not able to write status history: {}".format(e))
+
+    def open_history(self):
+        if self.history is None:
+            os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+            self.history = StatusHistory(self.history_path)
+        return self.history
+
+    def recovered_info(self, release, service, since):
+        return """
+                Release: {},
+                Service Type: {},
+                URL: {}
+                Status: recovered,\n\t  Down since: {}\n\n""".format(
+            release,
+            service,
+            self.url(release, service.split()[0]),
+            format_time(since),
+        )
+
+    def alert(self, alerts):
+        """Compare alerts, ((release, service), mail text) pairs with an empty
+        text for a good service, with the last known states. The new states
+        are returned, not saved, so that they are only saved once mailed.
+        Returns:
+                mail texts of the services gone down, of the recovered
+                services and, when the digest is due, of all services still
+                down; the new down states, or None if they could not be read,
+                and the new digest time, or None if unchanged."""
+        try:
+            history = self.open_history()
+            down_states = history.alert_states()
+            last_digest = history.last_digest()
+        except (OSError, sqlite3.Error) as e:
+            print("Not able to read alert states: {}".format(e))
+            logging.error("Not able to read alert states: {}".format(e))
+            return "".join(info for key, info in alerts), "", "", None, None
+        now = time.time()
+        down = {}
+        recovered_info = ""
+        for (release, service), info in alerts:
+            if info and (release, service) not in down_states:
+                down[(release, service)] = info
+            elif not info and (release, service) in down_states:
+                since = down_states.pop((release, service))[0]
+                recovered_info = recovered_info + self.recovered_info(
+                    release, service, since
+                )
+                logging.info("{} {} has recovered.".format(release, service))
+        down_info = "".join(down.values())
+        still_down_info = ""
+        digest_time = None
+        # The digest clock starts when the first service goes down, after all
+        # services were up.
+        if self.digest_hours and down_states:
+            if last_digest is None:
+                digest_time = now
+            elif now - last_digest >= self.digest_hours * 3600:
+                for (release, service), (since, info) in sorted(down_states.items()):
+                    still_down_info = (
+                        still_down_info
+                        + info.rstrip("\n")
+                        + "\n\t  Down since: {}\n\n".format(format_time(since))
+                    )
+                digest_time = now
+        elif self.digest_hours and down:
+            digest_time = now
+        for key, info in down.items():
+            down_states[key] = (now, info)
+        return down_info, recovered_info, still_down_info, down_states, digest_time
+
+    def notify(self, probes, probe_infos):
+        """Mail the services that went down or recovered since the last run,
+        and the digest of the services still down when it is due."""
+        latency_infos = self.latency_info(probes)
+        alerts = []
+        for probe, probe_info in zip(probes, probe_infos):
+            release, url_type = probe
+            alerts.append((probe, probe_info))
+            # Without latency metrics the latency alert states are kept as
+            # they are, rather than taken as recovered.
+            if latency_infos is not None:
+                alerts.append(
+                    ((release, url_type + " latency"), latency_infos.get(probe, ""))
+                )
+        (
+            down_info,
+            recovered_info,
+            still_down_info,
+            down_states,
+            digest_time,
+        ) = self.alert(alerts)
+        messages = []
+        if down_info or recovered_info:
+            messages.append(("Server check", self.mail_msg(down_info, recovered_info)))
+        if still_down_info:
+            messages.append(
+                (
+                    "Server check digest",
+                    self.mail_msg("", still_down_info=still_down_info),
+                )
+            )
+        if messages:
+            self.send_email_according_time(messages)
+        # Saved after the mail went out: a failed mail is sent again next run.
+        if down_states is not None:
+            try:
+                self.history.save_alert_states(down_states)
+                if digest_time is not None:
+                    self.history.set_last_digest(digest_time)
+            except sqlite3.Error as e:
+                print("Not able to save alert states: {}".format(e))
+                logging.error("Not able to save alert states: {}".format(e))
+
+    def run(self):
+        probes = self.release_probes()
+        # Probes run concurrently, the mail is assembled in release and
+        # service order whatever order they finish in.
+        probe_infos = self.check(probes)
+        self.record_history(probes, probe_infos)
+        self.prober.close()
+        self.notify(probes, probe_infos)
+
+    def stop(self, signum, frame):
+        print("Signal {} received, stopping server check.".format(signum))
+        logging.info("Signal {} received, stopping server check.".format(signum))
+        self.stop_event.set()
+
+    def next_interval(self, interval, was_failing, failing):
+        """Adaptive probe interval: a service that starts failing is probed
+        again after min_interval, then less often while it keeps failing, up
+        to interval; a healthy service is probed less and less often, up to
+        max_interval."""
+        if failing:
+            if not was_failing:
+                return self.min_interval
+            return min(self.interval, interval * 2)
+        if was_failing:
+            return self.interval
+        return min(self.max_interval, interval * 1.5)
+
+    def daemon(self, interval=1800, min_interval=60, max_interval=None, jitter=0.1):
+        """Probe every service on its own adaptive interval until SIGINT or
+        SIGTERM. Connections of the prober stay open between probes. Due
+        probes are checked together and mailed as one run."""
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval or 2 * interval
+        self.stop_event = threading.Event()
+        for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), self.stop)
+        probes = self.release_probes()
+        intervals = dict.fromkeys(probes, interval)
+        failing = dict.fromkeys(probes, False)
+        # First probes start at once, spread by the jitter of min_interval.
+        schedule = [
+            (time.monotonic() + random.uniform(0, jitter * min_interval), probe)
+            for probe in probes
+        ]
+        heapq.heapify(schedule)
+        log_day = self.time_stamp()
+        logging.info("Server check daemon started for {} services.".format(len(probes)))
+        while not self.stop_event.is_set():
+            if self.stop_event.wait(max(0, schedule[0][0] - time.monotonic())):
+                break
+            due = []
+            while schedule and schedule[0][0] <= time.monotonic():
+                due.append(heapq.heappop(schedule)[1])
+            due.sort(key=probes.index)
+            self.now = datetime.datetime.now()
+            if self.time_stamp() != log_day:
+                log_day = self.time_stamp()
+                self.create_log()
+            probe_infos = None
+            # Only the stop event ends the daemon: an error of one cycle, e.g.
+            # an unreachable mail server, is logged and the schedule goes on.
+            try:
+                probe_infos = self.check(due)
+                self.record_history(due, probe_infos)
+                self.notify(due, probe_infos)
+            except Exception as e:
+                print("Server check cycle failed: {!r}".format(e))
+                logging.exception("Server check cycle failed.")
+            for index, probe in enumerate(due):
+                if probe_infos is not None:
+                    intervals[probe] = self.next_interval(
+                        intervals[probe], failing[probe], bool(probe_infos[index])
+                    )
+                    failing[probe] = bool(probe_infos[index])
+                next_time = time.monotonic() + intervals[probe] * random.uniform(
+                    1 - jitter, 1 + jitter
+                )
+                heapq.heappush(schedule, (next_time, probe))
+        self.prober.close()
+        print("Server check daemon stopped.")
+        logging.info("Server check daemon stopped.")
 
 
 if __name__ == "__main__":
@@ -401,9 +877,103 @@ if __name__ == "__main__":
                         -notify abc@xyz.com,def@xyz.com for multiple users",
     )
 
+    parser.add_argument(
+        "-workers",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of services probed at the same time. Ex: -workers 8",
+    )
+
+    parser.add_argument(
+        "-probe_timeout",
+        "--probe_timeout",
+        type=int,
+        default=60,
+        help="seconds after which a probe is stopped and reported as down",
+    )
+
+    parser.add_argument(
+        "-deadline",
+        "--deadline",
+        type=int,
+        default=1500,
+        help="seconds after which all remaining probes are reported as down",
+    )
+
+    parser.add_argument(
+        "-backend",
+        "--backend",
+        default="http",
+        choices=["http", "wget"],
+        help="probe with pooled in-process HTTP connections or with wget.exe",
+    )
+
+    parser.add_argument(
+        "-latency_alert",
+        "--latency_alert",
+        help="alert when a percentile of a probe phase (dns, connect, tls, ttfb, \
+                        total) is above a number of seconds. \
+                        Ex: -latency_alert ttfb:p95:2,total:p99:10",
+    )
+
+    parser.add_argument(
+        "-daemon",
+        "--daemon",
+        action="store_true",
+        help="keep running and probe every service on its own interval",
+    )
+
+    parser.add_argument(
+        "-interval",
+        "--interval",
+        type=int,
+        default=1800,
+        help="seconds between probes of a service in daemon mode, shorter \
+                        while it fails and longer while it is healthy",
+    )
+
+    parser.add_argument(
+        "-min_interval",
+        "--min_interval",
+        type=int,
+        default=60,
+        help="seconds before a failing service is probed again in daemon mode",
+    )
+
+    parser.add_argument(
+        "-history",
+        "--history",
+        help="path of the SQLite status history database, \
+                        by default server_check\\server_check.db in LOCALAPPDATA",
+    )
+
+    parser.add_argument(
+        "-digest_hours",
+        "--digest_hours",
+        type=float,
+        help="also mail the list of services still down every number of hours. \
+                        Ex: -digest_hours 4",
+    )
+
     args = parser.parse_args()
     release_level = args.release_level
     notify = args.notify
-    server_check = ServerCheck(release_level=release_level, notify_users=notify)
+    server_check = ServerCheck(
+        release_level=release_level,
+        notify_users=notify,
+        workers=args.workers,
+        probe_timeout=args.probe_timeout,
+        run_deadline=args.deadline,
+        backend=args.backend,
+        history_path=args.history,
+        digest_hours=args.digest_hours,
+        latency_thresholds=parse_thresholds(args.latency_alert)
+        if args.latency_alert
+        else None,
+    )
     server_check.setup()
-    server_check.run()
+    if args.daemon:
+        server_check.daemon(interval=args.interval, min_interval=args.min_interval)
+    else:
+        server_check.run()
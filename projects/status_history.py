@@ -0,0 +1,231 @@
+'''
+    SQLite status history of server_check.
+
+    Every probe is one row of the probes table: time, release, service type,
+    URL, status code, up (1) or down (0), total latency in seconds, last
+    redirect target and COS station state. The rows of a run are inserted
+    in one transaction. The index on (release, service, time) also holds the
+    state, so the queries of one service are a range scan of the index only.
+    The services table lists the (release, service) pairs of the history.
+
+    The alert_state table holds the services that were down at the last
+    alert, with the time they went down and their mail text, and
+    alert_digest the time of the last digest mail.
+
+    USAGE:
+        python status_history.py -db server_check.db -query uptime -days 28
+        python status_history.py -db server_check.db -query last_change -release R423
+        python status_history.py -db server_check.db -query outages -service passport_url
+'''
+
+import time
+import sqlite3
+import argparse
+import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    time REAL NOT NULL,
+    release TEXT NOT NULL,
+    service TEXT NOT NULL,
+    url TEXT,
+    status TEXT,
+    up INTEGER NOT NULL,
+    latency REAL,
+    redirect TEXT,
+    cos_state TEXT
+);
+CREATE INDEX IF NOT EXISTS probes_release_service_time
+    ON probes (release, service, time, up);
+CREATE TABLE IF NOT EXISTS services (
+    release TEXT NOT NULL,
+    service TEXT NOT NULL,
+    PRIMARY KEY (release, service)
+);
+CREATE TABLE IF NOT EXISTS alert_state (
+    release TEXT NOT NULL,
+    service TEXT NOT NULL,
+    since REAL NOT NULL,
+    info TEXT NOT NULL,
+    PRIMARY KEY (release, service)
+);
+CREATE TABLE IF NOT EXISTS alert_digest (
+    time REAL NOT NULL
+);
+"""
+
+
+def format_time(seconds):
+    return datetime.datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class StatusHistory:
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        # Readers of the query CLI do not block the writing daemon.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def add_probes(self, rows):
+        """Insert rows (time, release, service, url, status, up, latency,
+        redirect, cos_state) in one transaction."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO services VALUES (?, ?)",
+                set((row[1], row[2]) for row in rows),
+            )
+
+    def services(self, release=None, service=None):
+        """(release, service) pairs in the history, optionally filtered."""
+        query = "SELECT release, service FROM services WHERE 1"
+        parameters = []
+        if release is not None:
+            query += " AND release = ?"
+            parameters.append(release)
+        if service is not None:
+            query += " AND service = ?"
+            parameters.append(service)
+        return self.connection.execute(
+            query + " ORDER BY release, service", parameters
+        ).fetchall()
+
+    def uptime(self, release, service, since):
+        """(uptime percentage, number of probes) since the time since."""
+        up, count = self.connection.execute(
+            "SELECT SUM(up), COUNT(*) FROM probes"
+            " WHERE release = ? AND service = ? AND time >= ?",
+            (release, service, since),
+        ).fetchone()
+        if not count:
+            return None, 0
+        return 100.0 * up / count, count
+
+    def last_state_change(self, release, service):
+        """(current state, time it started), (None, None) without history.
+        The time is that of the first probe in the history when the state
+        never changed."""
+        last = self.connection.execute(
+            "SELECT up FROM probes WHERE release = ? AND service = ?"
+            " ORDER BY time DESC LIMIT 1",
+            (release, service),
+        ).fetchone()
+        if last is None:
+            return None, None
+        up = last[0]
+        other = self.connection.execute(
+            "SELECT MAX(time) FROM probes"
+            " WHERE release = ? AND service = ? AND up != ?",
+            (release, service, up),
+        ).fetchone()[0]
+        changed = self.connection.execute(
+            "SELECT MIN(time) FROM probes"
+            " WHERE release = ? AND service = ? AND time > ?",
+            (release, service, other if other is not None else float("-inf")),
+        ).fetchone()[0]
+        return up, changed
+
+    def outages(self, release, service, since):
+        """(first down probe time, first up probe time after it or None)
+        of every outage since the time since."""
+        windows = []
+        start = None
+        for probe_time, up in self.connection.execute(
+            "SELECT time, up FROM probes"
+            " WHERE release = ? AND service = ? AND time >= ? ORDER BY time",
+            (release, service, since),
+        ):
+            if not up and start is None:
+                start = probe_time
+            elif up and start is not None:
+                windows.append((start, probe_time))
+                start = None
+        if start is not None:
+            windows.append((start, None))
+        return windows
+
+    def alert_states(self):
+        """dict of (release, service): (down since, mail text)."""
+        return {
+            (release, service): (since, info)
+            for release, service, since, info in self.connection.execute(
+                "SELECT release, service, since, info FROM alert_state"
+            )
+        }
+
+    def save_alert_states(self, states):
+        with self.connection:
+            self.connection.execute("DELETE FROM alert_state")
+            self.connection.executemany(
+                "INSERT INTO alert_state VALUES (?, ?, ?, ?)",
+                [key + value for key, value in states.items()],
+            )
+
+    def last_digest(self):
+        return self.connection.execute(
+            "SELECT MAX(time) FROM alert_digest"
+        ).fetchone()[0]
+
+    def set_last_digest(self, digest_time):
+        with self.connection:
+            self.connection.execute("DELETE FROM alert_digest")
+            self.connection.execute(
+                "INSERT INTO alert_digest VALUES (?)", (digest_time,)
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-db", "--db", required=True, help="path of history database")
+    parser.add_argument(
+        "-query",
+        "--query",
+        default="uptime",
+        choices=["uptime", "last_change", "outages"],
+        help="report to print",
+    )
+    parser.add_argument(
+        "-days", "--days", type=float, default=7, help="period of the report in days"
+    )
+    parser.add_argument(
+        "-release", "--release", help="only this release. Ex: -release R423"
+    )
+    parser.add_argument(
+        "-service", "--service", help="only this service. Ex: -service cos_url"
+    )
+    args = parser.parse_args()
+
+    history = StatusHistory(args.db)
+    since = time.time() - args.days * 24 * 3600
+    for release, service in history.services(args.release, args.service):
+        if args.query == "uptime":
+            uptime, count = history.uptime(release, service, since)
+            if count:
+                print(
+                    "{} {}: {:.2f}% up over {} probes".format(
+                        release, service, uptime, count
+                    )
+                )
+        elif args.query == "last_change":
+            up, changed = history.last_state_change(release, service)
+            print(
+                "{} {}: {} since {}".format(
+                    release, service, "up" if up else "down", format_time(changed)
+                )
+            )
+        else:
+            for start, end in history.outages(release, service, since):
+                print(
+                    "{} {}: down from {} to {}".format(
+                        release,
+                        service,
+                        format_time(start),
+                        format_time(end) if end is not None else "now",
+                    )
+                )
+    history.close()
@@ -0,0 +1,126 @@
+"""
+    Compare all csv files of two directory trees in one process pool.
+
+    Files are paired by their path relative to the tree roots. Every pair is
+    compared with csv_comparison.csv_comparison, the difference csv of a pair
+    is written under the difference directory with the same relative path,
+    and one summary.csv lists the status of every file:
+        identical, different, missing in new, missing in reference, error
+
+    USAGE:
+        python csv_batch_comparison.py -reference D:\\ref -new D:\\new -difference D:\\diff -workers 16
+"""
+
+import os
+import io
+import csv
+import sys
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import csv_comparison
+
+
+def csv_files(root):
+    """Relative paths, without extension, of all csv files under root,
+    compressed csv files included."""
+    extensions = [".csv"] + [".csv" + extension for extension in csv_comparison.compressed_extensions.values()]
+    relative_paths = set()
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            for extension in extensions:
+                if file_name.lower().endswith(extension):
+                    relative_path = os.path.relpath(os.path.join(dir_path, file_name), root)
+                    relative_paths.add(relative_path[: -len(extension)])
+    return relative_paths
+
+
+def compare_pair(reference_root, new_root, difference_root, relative_path, engine="hash"):
+    """Worker: compare one pair of files.
+    Returns:
+            (relative path, status, difference csv path, message)."""
+    relative_dir, name = os.path.split(relative_path)
+    difference_dir = os.path.join(difference_root, relative_dir)
+    os.makedirs(difference_dir, exist_ok=True)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            same = csv_comparison.csv_comparison(
+                name,
+                name,
+                difference_dir,
+                os.path.join(reference_root, relative_dir),
+                os.path.join(new_root, relative_dir),
+                engine=engine,
+                difference_csv=name + "_difference",
+            )
+    except Exception as e:
+        return relative_path, "error", "", str(e)
+    messages = output.getvalue().splitlines()
+    if same:
+        return relative_path, "identical", "", ""
+    if any(message.startswith("ERROR") for message in messages):
+        return relative_path, "error", "", " ".join(messages[-2:])
+    return relative_path, "different", os.path.join(difference_dir, name + "_difference.csv"), ""
+
+
+def compare_trees(reference_root, new_root, difference_root, workers=None, engine="hash"):
+    """Compare every csv file of reference_root with the same file of
+    new_root in a ProcessPoolExecutor of workers processes and write
+    difference_root/summary.csv.
+    Returns:
+            dict of number of files per status."""
+    reference_files = csv_files(reference_root)
+    new_files = csv_files(new_root)
+    results = []
+    for relative_path in sorted(reference_files - new_files):
+        results.append((relative_path, "missing in new", "", ""))
+    for relative_path in sorted(new_files - reference_files):
+        results.append((relative_path, "missing in reference", "", ""))
+
+    common_files = sorted(reference_files & new_files)
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Number of csv files to compare: " + str(len(common_files)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(compare_pair, reference_root, new_root, difference_root, relative_path, engine)
+            for relative_path in common_files
+        ]
+        for future in futures:
+            results.append(future.result())
+
+    results.sort()
+    os.makedirs(difference_root, exist_ok=True)
+    summary_path = os.path.join(difference_root, "summary.csv")
+    with open(summary_path, "w") as summary:
+        writer = csv.writer(summary, lineterminator="\n")
+        writer.writerow(["file", "status", "difference csv", "message"])
+        for relative_path, status, difference_path, message in results:
+            writer.writerow([relative_path + ".csv", status, difference_path, message])
+
+    totals = {}
+    for result in results:
+        totals[result[1]] = totals.get(result[1], 0) + 1
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Summary csv file: " + summary_path)
+    for status in sorted(totals):
+        print("INFO: [" + time.strftime("%H:%M:%S") + "] {}: {}".format(status, totals[status]))
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-reference", "--reference", required=True, help="root directory of reference csv files")
+    parser.add_argument("-new", "--new", required=True, help="root directory of new csv files")
+    parser.add_argument("-difference", "--difference", required=True, help="root directory for difference csv files")
+    parser.add_argument("-workers", "--workers", type=int, help="number of worker processes, default cpu count")
+    parser.add_argument(
+        "-engine",
+        "--engine",
+        default="hash",
+        help="comparison engine of csv_comparison. Ex: -engine indexed",
+    )
+    args = parser.parse_args()
+    totals = compare_trees(args.reference, args.new, args.difference, args.workers, args.engine)
+    if set(totals) - {"identical"}:
+        sys.exit(1)
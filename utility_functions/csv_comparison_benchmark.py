@@ -0,0 +1,463 @@
+"""
+    Benchmarks for csv_comparison.
+
+    Benchmark suite, every comparison function and engine on a generated
+    pair of files; results are appended to a JSON history file and compared
+    with the previous run of the same parameters:
+        python csv_comparison_benchmark.py -rows 1000000 -columns 8 -change_rate 0.01 -duplicate_rate 0.001
+        python csv_comparison_benchmark.py -rows 100000 -shuffle -sep_header -cases hash,key,key_sorted
+
+    Parallel speedup:
+        python csv_comparison_benchmark.py -rows 2000000 -workers 1,2,4,8,16,32
+
+    Parse engines of the comparison by column:
+        python csv_comparison_benchmark.py -rows 1000000 -parse_engines csv,pyarrow
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import random
+import argparse
+import shutil
+import datetime
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+
+import csv_comparison
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Rows of the new file are shuffled inside blocks of this size and the
+# blocks themselves are shuffled, so that 50M row files can be generated in
+# bounded memory.
+SHUFFLE_BLOCK = 100000
+
+# The linear engine is O(n*m) and only benchmarked up to this many rows.
+LINEAR_MAX_ROWS = 20000
+
+
+def _row(i, columns, seed):
+    """Deterministic values of row i: id and columns - 1 integers."""
+    return [str(i)] + [str((i * 2654435761 + j * 40503 + seed * 97) % 1000003) for j in range(1, columns)]
+
+
+def generate_pair(
+    work_dir,
+    rows,
+    columns=8,
+    duplicate_rate=0.0,
+    change_rate=0.01,
+    shuffle=False,
+    sep_header=False,
+    seed=0,
+):
+    """Write work_dir/reference.csv and work_dir/new.csv.
+    Args:
+            rows (int) : number of data rows of each file.
+            columns (int) : number of columns, the first one is "id".
+            duplicate_rate (float) : fraction of reference rows which repeat
+                    an earlier row.
+            change_rate (float) : fraction of rows with one value changed in
+                    the new file.
+            shuffle (bool) : shuffle the rows of the new file.
+            sep_header (bool) : start both files with the Excel "sep=," line.
+            seed (int) : seed of the generator, the same arguments always
+                    give the same files."""
+    rnd = random.Random(seed)
+    header = ",".join(["id"] + ["column" + str(j) for j in range(1, columns)]) + "\n"
+    reference_path = os.path.join(work_dir, "reference.csv")
+    new_path = os.path.join(work_dir, "new.csv")
+
+    def lines():
+        for i in range(rows):
+            source = rnd.randrange(i) if i and rnd.random() < duplicate_rate else i
+            row = _row(source, columns, seed)
+            changed = list(row)
+            if rnd.random() < change_rate:
+                j = rnd.randrange(1, columns) if columns > 1 else 0
+                changed[j] = str(int(changed[j]) + 1)
+            yield ",".join(row) + "\n", ",".join(changed) + "\n"
+
+    with open(reference_path, "w") as reference, open(new_path, "w") as new:
+        for csvfile in (reference, new):
+            if sep_header:
+                csvfile.write("sep=,\n")
+            csvfile.write(header)
+        if not shuffle:
+            for reference_line, new_line in lines():
+                reference.write(reference_line)
+                new.write(new_line)
+            return
+        with tempfile.TemporaryDirectory(dir=work_dir) as block_dir:
+            blocks = 0
+            block = []
+            for reference_line, new_line in lines():
+                reference.write(reference_line)
+                block.append(new_line)
+                if len(block) == SHUFFLE_BLOCK:
+                    rnd.shuffle(block)
+                    with open(os.path.join(block_dir, str(blocks)), "w") as block_file:
+                        block_file.writelines(block)
+                    blocks += 1
+                    block = []
+            if block:
+                rnd.shuffle(block)
+                with open(os.path.join(block_dir, str(blocks)), "w") as block_file:
+                    block_file.writelines(block)
+                blocks += 1
+            order = list(range(blocks))
+            rnd.shuffle(order)
+            for i in order:
+                with open(os.path.join(block_dir, str(i)), "r") as block_file:
+                    new.writelines(block_file)
+
+
+def _peak_rss_kb():
+    """Peak resident memory in KB of this process or of its largest
+    terminated child process, such as the workers of the parallel engine,
+    None if unknown."""
+    if resource is not None:
+        return max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset // 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def _compare(engine, **options):
+    def case(work_dir, diff_dir):
+        csv_comparison.csv_comparison(
+            "reference", "new", diff_dir, work_dir, work_dir, engine=engine, difference_csv=engine, **options
+        )
+
+    return case
+
+
+def _column(**options):
+    def case(work_dir, diff_dir):
+        csv_comparison.csv_comparison_on_specific_column(
+            "reference", "new", ["column1", "column2"], diff_dir, work_dir, work_dir, **options
+        )
+
+    return case
+
+
+def _tolerance(work_dir, diff_dir):
+    csv_comparison.csv_comparison_with_tolerance(
+        "reference", "new", ["column1", "column2"], diff_dir, work_dir, work_dir, rel_tol=1e-6
+    )
+
+
+def _check(work_dir, diff_dir):
+    csv_comparison.check_csv_data("new", work_dir)
+
+
+def _incremental(work_dir, diff_dir):
+    """Compare the first 99% of the new file with the "incremental" engine,
+    append the rest and time the second comparison only.
+    Returns:
+            seconds of the second comparison."""
+    new_path = os.path.join(diff_dir, "new.csv")
+    with open(os.path.join(work_dir, "new.csv"), "rb") as source, open(new_path, "wb") as target:
+        remaining = os.path.getsize(source.name) * 99 // 100
+        while remaining:
+            chunk = source.read(min(remaining, 1024 * 1024))
+            target.write(chunk)
+            remaining -= len(chunk)
+        target.write(source.readline())
+        tail_offset = source.tell()
+    csv_comparison.csv_comparison(
+        "reference", "new", diff_dir, work_dir, diff_dir, engine="incremental", difference_csv="incremental_head"
+    )
+    with open(os.path.join(work_dir, "new.csv"), "rb") as source, open(new_path, "ab") as target:
+        source.seek(tail_offset)
+        shutil.copyfileobj(source, target)
+    start = time.perf_counter()
+    csv_comparison.csv_comparison(
+        "reference", "new", diff_dir, work_dir, diff_dir, engine="incremental", difference_csv="incremental"
+    )
+    return time.perf_counter() - start
+
+
+def _validate(work_dir, diff_dir):
+    csv_comparison.validate_csv(os.path.join(work_dir, "new.csv"), required_columns=["id"])
+
+
+benchmark_cases = {
+    "hash": _compare("hash"),
+    "linear": _compare("linear"),
+    "partition": _compare("partition", memory_limit=64 * 1024 * 1024),
+    "parallel": _compare("parallel"),
+    "indexed": _compare("indexed"),
+    "bloom": _compare("bloom"),
+    "incremental": _incremental,
+    "position": _column(),
+    "position_pyarrow": _column(parse_engine="pyarrow"),
+    "key": _column(key_columns=["id"]),
+    "key_sorted": _column(key_columns=["id"], sorted_keys=True, key_type=int),
+    "key_indexed": _column(key_columns=["id"], indexed=True),
+    "tolerance": _tolerance,
+    "check_csv_data": _check,
+    "validate_csv": _validate,
+}
+
+
+def _available_cases(rows):
+    cases = list(benchmark_cases)
+    if rows > LINEAR_MAX_ROWS:
+        cases.remove("linear")
+    if csv_comparison.pyarrow is None:
+        cases.remove("position_pyarrow")
+    if csv_comparison.np is None:
+        cases.remove("tolerance")
+    return cases
+
+
+def _run_case(name, work_dir, result_queue):
+    """Child process of run_case: run one case quietly and report timings
+    and the errors it printed. A case which times only part of its work
+    returns its seconds."""
+    diff_dir = tempfile.mkdtemp(dir=work_dir)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        seconds = benchmark_cases[name](work_dir, diff_dir)
+        if seconds is None:
+            seconds = time.perf_counter() - start
+    # The comparison functions print their errors and return False.
+    errors = [
+        line
+        for line in output.getvalue().splitlines()
+        if line.startswith("ERROR:") or "could not be completed" in line
+    ]
+    result_queue.put((seconds, _peak_rss_kb(), "\n".join(errors)))
+
+
+def run_case(name, work_dir, rows):
+    """Run case name in a fresh process, so that its peak RSS is its own.
+    Returns:
+            dict of case, seconds, peak_rss_kb and rows_per_second; seconds
+            is None and error is set when the process failed or the case
+            printed an error."""
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case, args=(name, work_dir, result_queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result of a process that just exited is still in the pipe.
+                try:
+                    result = result_queue.get(timeout=1)
+                except queue.Empty:
+                    break
+    process.join()
+    if result is None or process.exitcode != 0:
+        error = "exit code {}".format(process.exitcode)
+    else:
+        seconds, peak_rss_kb, error = result
+    if error:
+        return {
+            "case": name,
+            "seconds": None,
+            "peak_rss_kb": None,
+            "rows_per_second": None,
+            "error": error,
+        }
+    return {
+        "case": name,
+        "seconds": round(seconds, 4),
+        "peak_rss_kb": peak_rss_kb,
+        "rows_per_second": round(rows / seconds) if seconds else None,
+    }
+
+
+def _git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("ascii")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(parameters, cases=None, history_path="benchmark_history.json", work_path=None):
+    """Generate the files described by parameters (arguments of
+    generate_pair), run cases (all available cases by default) and append
+    the record to the JSON list in history_path.
+    Returns:
+            (record, previous record with the same parameters or None)."""
+    cases = cases or _available_cases(parameters["rows"])
+    unknown = [name for name in cases if name not in benchmark_cases]
+    if unknown:
+        raise ValueError("Unknown benchmark cases: {}. Use some of {}.".format(unknown, list(benchmark_cases)))
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_path) as work_dir:
+        generate_pair(work_dir, **parameters)
+        for name in cases:
+            result = run_case(name, work_dir, parameters["rows"])
+            results.append(result)
+            if result["seconds"] is None:
+                print("{:<18} failed, {}".format(name, result["error"]))
+                continue
+            print(
+                "{:<18} {:>10.2f} s {:>12} KB {:>12} rows/s".format(
+                    name, result["seconds"], str(result["peak_rss_kb"]), str(result["rows_per_second"])
+                )
+            )
+
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "cpu_count": os.cpu_count(),
+        "parameters": parameters,
+        "results": results,
+    }
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path, "r") as history_file:
+            history = json.load(history_file)
+    previous = None
+    for old_record in reversed(history):
+        if old_record["parameters"] == parameters:
+            previous = old_record
+            break
+    history.append(record)
+    with open(history_path, "w") as history_file:
+        json.dump(history, history_file, indent=1)
+    return record, previous
+
+
+def print_comparison(record, previous):
+    """Print the change of wall time and peak RSS of every case against previous."""
+    if previous is None:
+        print("No previous run with the same parameters.")
+        return
+    print("Compared with {} (commit {}):".format(previous["time"], previous["commit"]))
+    old_results = {result["case"]: result for result in previous["results"]}
+    for result in record["results"]:
+        old = old_results.get(result["case"])
+        if old is None or result["seconds"] is None or old["seconds"] is None:
+            continue
+        time_change = (result["seconds"] / old["seconds"] - 1) * 100 if old["seconds"] else 0.0
+        line = "{:<18} time {:+7.1f} %".format(result["case"], time_change)
+        if result["peak_rss_kb"] and old["peak_rss_kb"]:
+            line += "   peak RSS {:+7.1f} %".format((result["peak_rss_kb"] / old["peak_rss_kb"] - 1) * 100)
+        print(line)
+
+
+def benchmark_parallel(rows, worker_counts, work_path=None):
+    """Time the "hash" engine and the "parallel" engine for every worker
+    count in worker_counts on two generated files of rows rows. On a single
+    CPU host with 1M rows: hash 2.2 s, parallel 1.7 s with 1, 2 and 4
+    workers. See parallel_diff for the serial part.
+    Returns:
+            list of (label, seconds, speedup against "hash")."""
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_path) as work_dir:
+        generate_pair(work_dir, rows, change_rate=0.1, seed=1)
+        runs = [("hash", {})] + [("parallel", {"workers": workers}) for workers in worker_counts]
+        for engine, options in runs:
+            start = time.perf_counter()
+            csv_comparison.csv_comparison(
+                "reference", "new", work_dir, work_dir, work_dir, engine=engine, **options
+            )
+            seconds = time.perf_counter() - start
+            label = engine if not options else "{} workers={}".format(engine, options["workers"])
+            results.append((label, seconds, results[0][1] / seconds if results else 1.0))
+    return results
+
+
+def benchmark_parse_engines(rows, parse_engines, columns=("column1", "column3", "column5"), work_path=None):
+    """Time csv_comparison_on_specific_column by position with every parse
+    engine in parse_engines on two generated files of rows rows.
+    Returns:
+            list of (label, seconds, speedup against the first engine)."""
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_path) as work_dir:
+        generate_pair(work_dir, rows, change_rate=0.1, seed=1)
+        for parse_engine in parse_engines:
+            start = time.perf_counter()
+            csv_comparison.csv_comparison_on_specific_column(
+                "reference", "new", list(columns), work_dir, work_dir, work_dir, parse_engine=parse_engine
+            )
+            seconds = time.perf_counter() - start
+            results.append((parse_engine, seconds, results[0][1] / seconds if results else 1.0))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-rows", "--rows", type=int, default=1000000, help="number of rows per file")
+    parser.add_argument("-columns", "--columns", type=int, default=8, help="number of columns per file")
+    parser.add_argument(
+        "-duplicate_rate", "--duplicate_rate", type=float, default=0.0, help="fraction of duplicate rows"
+    )
+    parser.add_argument("-change_rate", "--change_rate", type=float, default=0.01, help="fraction of changed rows")
+    parser.add_argument("-shuffle", "--shuffle", action="store_true", help="shuffle the rows of the new file")
+    parser.add_argument("-sep_header", "--sep_header", action="store_true", help="write the Excel sep=, line")
+    parser.add_argument("-seed", "--seed", type=int, default=0, help="seed of the generated files")
+    parser.add_argument(
+        "-cases",
+        "--cases",
+        help="comma separated cases of the suite, default all. Ex: -cases {}".format(",".join(benchmark_cases)),
+    )
+    parser.add_argument(
+        "-history",
+        "--history",
+        default="benchmark_history.json",
+        help="JSON file collecting the results of every run",
+    )
+    parser.add_argument("-workers", "--workers", help="comma separated worker counts. Ex: -workers 1,2,4,8")
+    parser.add_argument(
+        "-parse_engines",
+        "--parse_engines",
+        help="comma separated parse engines to benchmark. Ex: -parse_engines csv,pyarrow",
+    )
+    parser.add_argument("-work_path", "--work_path", help="directory for the generated files")
+    args = parser.parse_args()
+    if args.workers or args.parse_engines:
+        if args.parse_engines:
+            results = benchmark_parse_engines(args.rows, args.parse_engines.split(","), work_path=args.work_path)
+        else:
+            worker_counts = [int(i) for i in args.workers.split(",")]
+            results = benchmark_parallel(args.rows, worker_counts, args.work_path)
+        print("Rows: {}, cpu count: {}".format(args.rows, os.cpu_count()))
+        for label, seconds, speedup in results:
+            print("{:<24} {:>10.2f} s {:>8.2f} x".format(label, seconds, speedup))
+    else:
+        parameters = {
+            "rows": args.rows,
+            "columns": args.columns,
+            "duplicate_rate": args.duplicate_rate,
+            "change_rate": args.change_rate,
+            "shuffle": args.shuffle,
+            "sep_header": args.sep_header,
+            "seed": args.seed,
+        }
+        cases = args.cases.split(",") if args.cases else None
+        if cases and not set(cases) <= set(benchmark_cases):
+            parser.error("unknown cases in -cases. Use some of {}".format(",".join(benchmark_cases)))
+        record, previous = run_suite(parameters, cases, args.history, args.work_path)
+        print_comparison(record, previous)
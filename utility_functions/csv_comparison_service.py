@@ -0,0 +1,255 @@
+"""
+    Resident csv comparison service.
+
+    Keeps parsed reference csv files in memory so that short-lived test
+    processes do not re-parse the same baselines. The server listens on
+    localhost and accepts concurrent requests:
+
+        POST /compare  {"base_csv": "D:\\ref\\a.csv", "new_csv": "D:\\new\\a.csv",
+                        "difference_csv": "D:\\diff\\a_difference.csv"}
+            -> {"same": false, "different_rows": 3, "difference_csv": "...",
+                "cache_hit": true, "seconds": 0.012}
+        GET /stats
+            -> cache hit rate, cache size and request latency percentiles
+
+    Baselines are kept in an LRU cache bounded by an estimate of their memory
+    size, and reloaded when the size or mtime of the file changes.
+
+    USAGE:
+        python csv_comparison_service.py -port 8765 -cache_mb 4096
+        compare("D:\\ref\\a.csv", "D:\\new\\a.csv", "D:\\diff\\a_difference.csv")
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import urllib.request as ur
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import csv_comparison
+
+# Estimated memory of one cached line besides its text: str header and
+# Counter entry.
+LINE_OVERHEAD = 120
+
+
+class Baseline:
+    """Parsed reference csv file: line counts, digest and memory estimate."""
+
+    def __init__(self, file_path):
+        stat = os.stat(file_path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.digest = csv_comparison.file_digest(file_path)
+        with csv_comparison.open_csv(file_path, "r") as original:
+            self.lines = Counter(original)
+        # Decompressed text of the distinct lines, not the size on disk,
+        # which is smaller for a compressed baseline.
+        self.memory = sum(map(len, self.lines)) + LINE_OVERHEAD * len(self.lines)
+
+    def is_current(self, file_path):
+        stat = os.stat(file_path)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def diff(self, new, outFile):
+        """hash_diff against the cached counts, which are left unchanged so
+        that concurrent requests can share them."""
+        used = Counter()
+        count = 0
+        for line in new:
+            if used.get(line, 0) < self.lines.get(line, 0):
+                used[line] += 1
+            else:
+                outFile.write(line)
+                count += 1
+        return count
+
+
+class BaselineCache:
+    """LRU cache of Baseline objects bounded by max_memory bytes. A baseline
+    is parsed once however many requests ask for it at the same time."""
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = 0
+        self.baselines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # file path -> Future of the Baseline being parsed
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, file_path):
+        """Return (Baseline, cache hit) for file_path."""
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            baseline = self.baselines.get(file_path)
+            if baseline is not None and baseline.is_current(file_path):
+                self.baselines.move_to_end(file_path)
+                self.hits += 1
+                return baseline, True
+            loading = self.loading.get(file_path)
+            if loading is None:
+                loading = self.loading[file_path] = Future()
+                self.misses += 1
+                waiting = False
+            else:
+                waiting = True
+
+        if waiting:
+            # Another request is parsing the baseline: share it.
+            baseline = loading.result()
+            with self.lock:
+                self.hits += 1
+            return baseline, True
+        try:
+            baseline = Baseline(file_path)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[file_path]
+            loading.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[file_path]
+            previous = self.baselines.pop(file_path, None)
+            if previous is not None:
+                self.memory -= previous.memory
+            if baseline.memory <= self.max_memory:
+                self.baselines[file_path] = baseline
+                self.memory += baseline.memory
+                while self.memory > self.max_memory:
+                    evicted_path, evicted = self.baselines.popitem(last=False)
+                    self.memory -= evicted.memory
+                    print("INFO: [" + time.strftime("%H:%M:%S") + "] Baseline evicted: " + evicted_path)
+        loading.set_result(baseline)
+        return baseline, False
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "baselines": len(self.baselines),
+                "memory_bytes": self.memory,
+                "max_memory_bytes": self.max_memory,
+            }
+
+
+class ComparisonService:
+    def __init__(self, cache_mb=4096, latency_window=10000):
+        self.cache = BaselineCache(cache_mb * 1024 * 1024)
+        self.latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def compare(self, base_csv, new_csv, difference_csv):
+        start = time.perf_counter()
+        baseline, cache_hit = self.cache.get(base_csv)
+        if os.path.getsize(new_csv) == baseline.size and csv_comparison.file_digest(new_csv) == baseline.digest:
+            count = 0
+            difference_csv = None
+        else:
+            with csv_comparison.open_csv(new_csv, "r") as new:
+                with csv_comparison.open_csv(difference_csv, "w") as outFile:
+                    count = baseline.diff(new, outFile)
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+        return {
+            "same": count == 0,
+            "different_rows": count,
+            "difference_csv": difference_csv,
+            "cache_hit": cache_hit,
+            "seconds": seconds,
+        }
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests = self.requests
+        stats = self.cache.stats()
+        stats["requests"] = requests
+        for percentile in (50, 90, 99):
+            if latencies:
+                stats["latency_p{}_seconds".format(percentile)] = latencies[
+                    min(len(latencies) - 1, len(latencies) * percentile // 100)
+                ]
+        return stats
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {"error": "unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/compare":
+            self.send_json(404, {"error": "unknown path " + self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            result = self.service.compare(request["base_csv"], request["new_csv"], request["difference_csv"])
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8765, cache_mb=4096):
+    RequestHandler.service = ComparisonService(cache_mb)
+    server = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] CSV comparison service on http://127.0.0.1:{}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def compare(base_csv, new_csv, difference_csv, port=8765):
+    """Client: ask the service on localhost:port to compare new_csv against
+    base_csv. Returns the result dictionary."""
+    request = ur.Request(
+        "http://127.0.0.1:{}/compare".format(port),
+        data=json.dumps(
+            {
+                "base_csv": os.path.abspath(base_csv),
+                "new_csv": os.path.abspath(new_csv),
+                "difference_csv": os.path.abspath(difference_csv),
+            }
+        ).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with ur.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-port", "--port", type=int, default=8765, help="localhost port of the service")
+    parser.add_argument("-cache_mb", "--cache_mb", type=int, default=4096, help="memory bound of cached baselines")
+    args = parser.parse_args()
+    serve(args.port, args.cache_mb)
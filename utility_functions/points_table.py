@@ -0,0 +1,102 @@
+"""
+    Points table of a prediction workbook.
+
+    The first sheet holds one match per row: the winner in the result column
+    and one column of predicted winners per player. A correct prediction is
+    worth 2 points to the predicted team. Predictions are read column after
+    column and grouped in blocks of matches_per_block matches; the points of
+    every team in every block are written to the points sheet, one column
+    per block starting at first_points_column, one row per team starting at
+    first_team_row.
+
+    The sheet is loaded once into a numpy array and the points of all teams
+    and blocks are counted with a single bincount.
+
+    USAGE:
+        python points_table.py -workbook "D:\\Important Data\\Book1.xlsx"
+"""
+
+import time
+import argparse
+
+import numpy as np
+import openpyxl
+
+teams = ["ENG", "SA", "IND", "AUS", "NZ", "PAK", "BAN", "SL", "AF", "WI"]
+
+
+def team_points(results, predictions, teams, matches_per_block=45, points_per_win=2):
+    """Points of every team in every block of predictions.
+    Args:
+            results : array of the winner of every match.
+            predictions : 2 dimensional array, matches x players, of
+                    predicted winners.
+    Returns:
+            array teams x blocks of points."""
+    correct = predictions == results[:, None]
+    team_index = {team: index for index, team in enumerate(teams)}
+    result_teams = np.array([team_index.get(result, -1) for result in results])
+    # Predictions are counted column after column: position of a prediction
+    # in that order gives its block.
+    rows, columns = predictions.shape
+    position = np.arange(columns)[None, :] * rows + np.arange(rows)[:, None]
+    block = position // matches_per_block
+    blocks = -(-rows * columns // matches_per_block)
+
+    row_teams = np.broadcast_to(result_teams[:, None], predictions.shape)
+    selected = correct & (row_teams >= 0)
+    counts = np.bincount(
+        row_teams[selected] * blocks + block[selected], minlength=len(teams) * blocks
+    ).reshape(len(teams), blocks)
+    return points_per_win * counts
+
+
+def points_table(
+    workbook_path,
+    teams=teams,
+    points_sheet="Sheet2",
+    result_column=5,
+    first_prediction_column=8,
+    footer_rows=3,
+    matches_per_block=45,
+    first_team_row=3,
+    first_points_column=3,
+):
+    """Compute the points table of the first sheet of workbook_path and save
+    it in points_sheet. Columns and rows are 1-based as in Excel; the first
+    row of the first sheet is a header and the last footer_rows rows are not
+    matches.
+    Returns:
+            array teams x blocks of points."""
+    workbook = openpyxl.load_workbook(workbook_path)
+    matches = np.array(list(workbook.worksheets[0].iter_rows(min_row=2, values_only=True)), dtype=object)
+    matches = matches[: len(matches) - footer_rows]
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Number of matches: " + str(len(matches)))
+    points = team_points(
+        matches[:, result_column - 1],
+        matches[:, first_prediction_column - 1 :],
+        teams,
+        matches_per_block,
+    )
+
+    worksheet = workbook[points_sheet]
+    for row in worksheet.iter_rows(
+        min_row=first_team_row,
+        max_row=first_team_row + len(teams) - 1,
+        min_col=first_points_column,
+        max_col=first_points_column + points.shape[1] - 1,
+    ):
+        for cell, value in zip(row, points[row[0].row - first_team_row]):
+            cell.value = int(value)
+    workbook.save(workbook_path)
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Points table written: " + workbook_path)
+    return points
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-workbook", "--workbook", required=True, help="path of xlsx workbook")
+    parser.add_argument("-points_sheet", "--points_sheet", default="Sheet2", help="name of points table sheet")
+    parser.add_argument("-matches", "--matches", type=int, default=45, help="matches per points column")
+    args = parser.parse_args()
+    points_table(args.workbook, points_sheet=args.points_sheet, matches_per_block=args.matches)
@@ -0,0 +1,210 @@
+"""
+    Compare two xlsx workbooks sheet by sheet in bounded memory.
+
+    Sheets are paired by name and streamed with openpyxl in read-only mode.
+    Rows are matched as in the hash engine of csv_comparison: every reference
+    row is reduced to a 64 bit hash, every new row is looked up in the
+    multiset of reference hashes, so moved rows are not reported. Only the
+    unmatched rows are kept in memory. Matched rows are anchors: the
+    unmatched new rows after an anchor are paired in order with the
+    unmatched reference rows after the reference row of the anchor, and
+    reported cell by cell as changed. The unpaired rows are reported as
+    added or removed, so a row inserted above an edited row gives one added
+    row and one changed row. With key columns, unmatched rows are paired by
+    the values of these columns instead, wherever they are in the sheets.
+
+    The difference csv file has one line per cell:
+        sheet, row, column, status, reference value, new value
+    with status changed, added, removed, or "sheet added" / "sheet removed".
+    row is the row number in the new sheet, or in the reference sheet for
+    removed rows.
+
+    USAGE:
+        python xlsx_comparison.py -reference D:\\ref\\book.xlsx -new D:\\new\\book.xlsx -difference D:\\diff\\book.csv
+        python xlsx_comparison.py -reference D:\\ref\\book.xlsx -new D:\\new\\book.xlsx -difference D:\\diff\\book.csv -key_columns A
+"""
+
+import sys
+import csv
+import time
+import argparse
+from array import array
+from itertools import zip_longest
+from bisect import bisect_left, bisect_right
+
+import openpyxl
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from csv_reference_index import key_hash
+
+
+def _row_values(row):
+    """Cell values of a row as strings, without trailing empty cells."""
+    values = ["" if value is None else str(value) for value in row]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+def _sheet_rows(worksheet):
+    """(row number, values) of every row of worksheet, empty rows included."""
+    for row_number, row in enumerate(worksheet.iter_rows(values_only=True), 1):
+        yield row_number, _row_values(row)
+
+
+def _reference_hashes(worksheet):
+    """Row hashes of worksheet sorted, and the row numbers in the same order."""
+    row_hashes = array("Q", (key_hash(values) for row_number, values in _sheet_rows(worksheet)))
+    order = sorted(range(len(row_hashes)), key=row_hashes.__getitem__)
+    hashes = array("Q", (row_hashes[i] for i in order))
+    row_numbers = array("L", (i + 1 for i in order))
+    return hashes, row_numbers
+
+
+def _cell_differences(sheet_name, row_number, reference_values, new_values, status):
+    for column in range(max(len(reference_values), len(new_values))):
+        reference_value = reference_values[column] if column < len(reference_values) else ""
+        new_value = new_values[column] if column < len(new_values) else ""
+        if reference_value != new_value:
+            yield [sheet_name, row_number, get_column_letter(column + 1), status, reference_value, new_value]
+
+
+def _key_pairs(added, removed, key_columns):
+    """Pair the unmatched new rows of added with the unmatched reference rows
+    of removed that have the same values in key_columns, in row order.
+    Returns:
+            list of (new row or None, reference row number or None)."""
+    indices = [column_index_from_string(column) - 1 for column in key_columns]
+
+    def key(values):
+        return tuple(values[i] if i < len(values) else "" for i in indices)
+
+    reference_rows = {}
+    for row_number in sorted(removed):
+        reference_rows.setdefault(key(removed[row_number]), []).append(row_number)
+    pairs = []
+    for new_row in sorted(row for rows in added.values() for row in rows):
+        rows = reference_rows.get(key(new_row[1]))
+        pairs.append((new_row, rows.pop(0) if rows else None))
+    pairs.extend((None, row_number) for rows in reference_rows.values() for row_number in rows)
+    return pairs
+
+
+def sheet_diff(sheet_name, reference_sheet, new_sheet, writer, key_columns=None):
+    """Write the cell differences of two worksheets. key_columns, column
+    letters such as ["A"], pair the unmatched rows by key instead of by
+    position between matched rows.
+    Returns:
+            number of lines written."""
+    hashes, row_numbers = _reference_hashes(reference_sheet)
+    used = bytearray(len(hashes))
+    # reference row number of the last matched row -> unmatched new rows
+    # (row number, values) after it
+    added = {}
+    anchor = 0
+    for row_number, values in _sheet_rows(new_sheet):
+        hash_value = key_hash(values)
+        position = bisect_left(hashes, hash_value)
+        last = bisect_right(hashes, hash_value, position)
+        while position < last and used[position]:
+            position += 1
+        if position < last:
+            used[position] = 1
+            anchor = row_numbers[position]
+        else:
+            added.setdefault(anchor, []).append((row_number, values))
+
+    removed_rows = set(row_numbers[i] for i in range(len(used)) if not used[i])
+    del hashes, row_numbers, used
+    removed = {}
+    if removed_rows:
+        for row_number, values in _sheet_rows(reference_sheet):
+            if row_number in removed_rows:
+                removed[row_number] = values
+
+    if key_columns:
+        pairs = _key_pairs(added, removed, key_columns)
+    else:
+        # Runs of consecutive unmatched reference rows, by the matched row before them.
+        removed_runs = {}
+        previous = None
+        for row_number in sorted(removed):
+            if previous is None or row_number != previous + 1:
+                run = removed_runs.setdefault(row_number - 1, [])
+            run.append(row_number)
+            previous = row_number
+        pairs = []
+        for anchor in sorted(set(added) | set(removed_runs)):
+            pairs.extend(zip_longest(added.get(anchor, []), removed_runs.get(anchor, [])))
+
+    differences = []
+    for new_row, reference_row in pairs:
+        if new_row is None:
+            differences.append((reference_row, "removed", removed[reference_row], []))
+        elif reference_row is None:
+            differences.append((new_row[0], "added", [], new_row[1]))
+        else:
+            differences.append((new_row[0], "changed", removed[reference_row], new_row[1]))
+
+    count = 0
+    for row_number, status, reference_values, new_values in sorted(differences, key=lambda d: d[:2]):
+        for line in _cell_differences(sheet_name, row_number, reference_values, new_values, status):
+            writer.writerow(line)
+            count += 1
+    return count
+
+
+def xlsx_comparison(reference_xlsx, new_xlsx, difference_csv, key_columns=None):
+    """This function compare two xlsx workbooks.
+    Args:
+            reference_xlsx (str) : path of reference workbook.
+            new_xlsx (str) : path of new workbook.
+            difference_csv (str) : path of difference csv file.
+            key_columns (list) : column letters identifying a row, e.g. ["A"].
+                    When given, changed rows are found by key instead of by
+                    position.
+    Returns:
+            True if both workbooks have the same cell values."""
+    reference_book = openpyxl.load_workbook(reference_xlsx, read_only=True, data_only=True)
+    new_book = openpyxl.load_workbook(new_xlsx, read_only=True, data_only=True)
+    count = 0
+    try:
+        with open(difference_csv, "w", newline="") as outFile:
+            writer = csv.writer(outFile, lineterminator="\n")
+            writer.writerow(["sheet", "row", "column", "status", "reference value", "new value"])
+            for sheet_name in reference_book.sheetnames:
+                if sheet_name not in new_book.sheetnames:
+                    writer.writerow([sheet_name, "", "", "sheet removed", "", ""])
+                    count += 1
+                    continue
+                print("INFO: [" + time.strftime("%H:%M:%S") + "] Comparing sheet: " + sheet_name)
+                count += sheet_diff(
+                    sheet_name, reference_book[sheet_name], new_book[sheet_name], writer, key_columns
+                )
+            for sheet_name in new_book.sheetnames:
+                if sheet_name not in reference_book.sheetnames:
+                    writer.writerow([sheet_name, "", "", "sheet added", "", ""])
+                    count += 1
+    finally:
+        reference_book.close()
+        new_book.close()
+
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Difference csv file: " + difference_csv)
+    if count == 0:
+        print("INFO: [" + time.strftime("%H:%M:%S") + "] XLSX Comparison: Both workbooks are same.")
+        return True
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] XLSX Comparison: Both workbooks are different.")
+    print("INFO: [" + time.strftime("%H:%M:%S") + "] Number of different cells: " + str(count))
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-reference", "--reference", required=True, help="path of reference xlsx file")
+    parser.add_argument("-new", "--new", required=True, help="path of new xlsx file")
+    parser.add_argument("-difference", "--difference", required=True, help="path of difference csv file")
+    parser.add_argument("-key_columns", "--key_columns", help="comma separated key column letters. Ex: -key_columns A,B")
+    args = parser.parse_args()
+    key_columns = args.key_columns.split(",") if args.key_columns else None
+    if not xlsx_comparison(args.reference, args.new, args.difference, key_columns):
+        sys.exit(1)